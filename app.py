@@ -1,20 +1,30 @@
-from flask import Flask, render_template, request, jsonify, session, redirect
+from flask import Flask, render_template, request, jsonify, session, redirect, Response, stream_with_context, url_for
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 import tensorflow as tf
 from tensorflow.keras.models import load_model
 from PIL import Image
 import numpy as np
 import io
+import json
 import base64
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
 import bcrypt
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 import secrets
 import gdown
+import queue
+import threading
+import time
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, wraps
 
 # Load environment variables
 load_dotenv()
@@ -22,26 +32,47 @@ load_dotenv()
 # Initialize Flask App
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
+# Reject oversized uploads before the request body is buffered
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', 10)) * 1024 * 1024
 CORS(app)
 
-# MongoDB Setup
-client = MongoClient(os.getenv('MONGODB_URI'))
+# MongoDB Setup (connect=False defers connecting until first use, after gunicorn forks)
+client = MongoClient(os.getenv('MONGODB_URI'), maxPoolSize=50, connect=False)
 db = client['plant_disease_db']
 users_collection = db['users']
 predictions_collection = db['predictions']
 
+# bcrypt cost for new password hashes; existing hashes keep verifying at their own cost
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 10))
+
+# Prediction logs are queued and bulk-inserted by a background thread, off the request path
+PREDICTION_LOG_BATCH = int(os.getenv('PREDICTION_LOG_BATCH', 50))
+PREDICTION_LOG_INTERVAL_MS = float(os.getenv('PREDICTION_LOG_INTERVAL_MS', 500))
+prediction_log_queue = queue.Queue(maxsize=10000)
+prediction_log_worker = None
+prediction_log_lock = threading.Lock()
+
 # Gemini API Setup
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+GEMINI_MODEL = genai.GenerativeModel('gemini-1.5-flash-exp-0827')  # Shared by all helpers; adjust model name if needed
+
+# Shared HTTP session so Open-Meteo connections are kept alive between requests
+HTTP = requests.Session()
+HTTP.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=50))
 
 # Google Drive model download configuration
 MODEL_PATH = 'models/plant_disease_model.h5'
 MODEL_DRIVE_ID = '11C1dg8Rxiypd8Kq_d_n6AHktr-mocBie'  # Replace with YOUR file ID if different
 
+# Converted models produced by convert_model.py (used instead of the H5 when present)
+TFLITE_MODEL_PATH = 'models/plant_disease_model.tflite'
+SAVED_MODEL_PATH = 'models/plant_disease_model_savedmodel'
+
 # Create models directory if it doesn't exist
 os.makedirs('models', exist_ok=True)
 
-# Download model from Google Drive if not present
-if not os.path.exists(MODEL_PATH):
+# Download model from Google Drive if not present (no converted model to fall back on)
+if not os.path.exists(MODEL_PATH) and not (os.path.exists(TFLITE_MODEL_PATH) or os.path.isdir(SAVED_MODEL_PATH)):
     print("📥 Downloading model from Google Drive...")
     try:
         gdown.download(
@@ -53,13 +84,28 @@ if not os.path.exists(MODEL_PATH):
     except Exception as e:
         print(f"❌ Error downloading model: {e}")
 
-# Load Plant Disease Model
-try:
-    disease_model = load_model(MODEL_PATH)
-    print("✓ Model loaded successfully!")
-except Exception as e:
-    print(f"✗ Error loading model: {e}")
-    disease_model = None
+# TF/TFLite threads per process; gunicorn.conf.py divides the cores between its workers
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', os.cpu_count() or 1))
+
+# Per-process model state, filled by load_disease_model() after gunicorn forks so
+# that TF's runtime and thread pools are never started in the master process
+tflite_interpreters = {}
+disease_model = None
+INFER_FN = None
+model_load_attempted = False
+model_load_lock = threading.Lock()
+
+# Thread pool for Gemini calls that overlap with model inference. Each detect request
+# holds up to two slots (validation + disease info), so gunicorn.conf.py sizes it
+# to twice the request threads; the default matches its 32 threads
+gemini_executor = ThreadPoolExecutor(max_workers=int(os.getenv('GEMINI_WORKERS', 64)))
+
+# Micro-batching: concurrent requests are stacked into a single inference call
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', 8))
+BATCH_TIMEOUT_MS = float(os.getenv('BATCH_TIMEOUT_MS', 5))
+batch_queue = queue.Queue()
+batch_worker = None
+batch_worker_lock = threading.Lock()
 
 # 38 Disease Classes from Kaggle Dataset
 CLASS_NAMES = [
@@ -93,25 +139,108 @@ LANGUAGE_CODES = {
 
 # ============== HELPER FUNCTIONS ==============
 
-def get_plant_list():
-    """Extract unique plant names from class names"""
+def ttl_cache(ttl_seconds, maxsize=256):
+    """Memoize results for ttl_seconds, evicting the oldest entry once maxsize is reached"""
+    def decorator(func):
+        cache = {}
+        lock = threading.Lock()
+
+        def cache_get(*args):
+            """Return (hit, value) so cached None results still count as hits"""
+            with lock:
+                entry = cache.get(args)
+                if entry and entry[0] > time.monotonic():
+                    return True, entry[1]
+            return False, None
+
+        def cache_set(args, value):
+            with lock:
+                if args not in cache and len(cache) >= maxsize:
+                    cache.pop(next(iter(cache)))
+                cache[args] = (time.monotonic() + ttl_seconds, value)
+
+        @wraps(func)
+        def wrapper(*args):
+            hit, value = cache_get(*args)
+            if not hit:
+                value = func(*args)
+                cache_set(args, value)
+            return value
+
+        # Exposed so streaming callers can share the cache with the wrapped function
+        wrapper.cache_get = cache_get
+        wrapper.cache_set = cache_set
+        return wrapper
+    return decorator
+
+
+def clean_plant_name(class_name):
+    """Extract the display plant name from a class name"""
+    plant_name = class_name.split('___')[0]
+    return plant_name.replace('_', ' ').replace('(including sour)', '').replace(',', '').strip()
+
+
+def index_plant_classes():
+    """Group class indices by plant name in a single pass over CLASS_NAMES"""
+    plant_classes = {}
     plants = set()
-    for class_name in CLASS_NAMES:
-        plant_name = class_name.split('___')[0]
-        # Clean up plant names
-        plant_name = plant_name.replace('_', ' ').replace('(including sour)', '').replace(',', '').strip()
+    for idx, class_name in enumerate(CLASS_NAMES):
+        plant_name = clean_plant_name(class_name)
         plants.add(plant_name)
-    return sorted(list(plants))
+        plant_classes.setdefault(plant_name.lower(), []).append((idx, class_name))
+    return plant_classes, sorted(plants)
+
+
+# Precomputed once at import so request handlers only do dict lookups
+PLANT_CLASSES, PLANT_LIST = index_plant_classes()
+PLANT_CLASS_INDICES = {
+    plant: np.array([idx for idx, _ in classes], dtype=np.int64)
+    for plant, classes in PLANT_CLASSES.items()
+}
+
 
+def disease_display_name(class_name):
+    """Extract the human-readable disease name from a class name"""
+    disease_name = class_name.split('___')[1] if '___' in class_name else class_name
+    return disease_name.replace('_', ' ').strip()
+
+
+# Disease names the model can report per plant, used to validate disease-info requests
+PLANT_DISEASES = {
+    plant: {disease_display_name(class_name) for _, class_name in classes}
+    for plant, classes in PLANT_CLASSES.items()
+}
+
+
+# Model input resolution
+MODEL_INPUT_SIZE = (256, 256)
+
+# Image formats Gemini accepts as raw bytes; anything else is re-encoded by the SDK
+GEMINI_IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif'}
+
+
+def decode_once(image_data):
+    """Decode uploaded bytes once per request; returns the RGB image and its MIME type"""
+    img = Image.open(io.BytesIO(image_data))
+    # Phone cameras often save MPO, whose first frame is a plain JPEG Gemini accepts
+    mime_type = 'image/jpeg' if img.format == 'MPO' else Image.MIME.get(img.format, 'image/jpeg')
+    if mime_type in GEMINI_IMAGE_TYPES:
+        # Gemini gets the raw bytes, so the decoded image is only used by the model:
+        # let the JPEG decoder downscale in the DCT domain to roughly 256x256
+        img.draft('RGB', MODEL_INPUT_SIZE)
+    return img.convert('RGB'), mime_type
 
-PLANT_LIST = get_plant_list()
 
+def gemini_image_part(image_data, img, mime_type):
+    """Build the Gemini image part, passing the original upload bytes when supported"""
+    if mime_type in GEMINI_IMAGE_TYPES:
+        return {'mime_type': mime_type, 'data': image_data}
+    return img
 
-def validate_plant_image(image_data, selected_plant):
+
+def validate_plant_image(image_part, selected_plant):
     """Validate if uploaded image matches the selected plant using Gemini API"""
     try:
-        img = Image.open(io.BytesIO(image_data))
-
         prompt = f"""Analyze this image and determine:
         1. Is this a plant leaf image? (YES/NO)
         2. Does this appear to be a {selected_plant} plant? (YES/NO)
@@ -123,8 +252,7 @@ def validate_plant_image(image_data, selected_plant):
         Example response: YES, YES
         Do not provide any other text."""
 
-        model = genai.GenerativeModel('gemini-1.5-flash-exp-0827')  # Updated to a valid experimental model name; adjust if needed
-        response = model.generate_content([prompt, img])
+        response = GEMINI_MODEL.generate_content([prompt, image_part])
         result = response.text.strip().upper()
 
         # Parse response
@@ -138,33 +266,208 @@ def validate_plant_image(image_data, selected_plant):
         return True, True  # Default to True if validation fails
 
 
-def preprocess_image(image_data):
-    """Preprocess image for model prediction"""
-    img = Image.open(io.BytesIO(image_data))
-    img = img.convert('RGB')
-    img = img.resize((256, 256))
-    img_array = np.array(img) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+# uint8 pixel -> float32 [0, 1] lookup table, gathered instead of dividing per pixel
+RESCALE_LUT = np.arange(256, dtype=np.float32) / np.float32(255.0)
+
+
+def preprocess_image(img):
+    """Preprocess a decoded RGB image for model prediction"""
+    img = img.resize(MODEL_INPUT_SIZE, reducing_gap=3.0)
+    img_array = RESCALE_LUT[np.asarray(img, dtype=np.uint8)]
+    return img_array[None, ...]
+
+
+def tflite_batch_sizes():
+    """Fixed batch sizes with a preallocated interpreter each: powers of two up to BATCH_SIZE"""
+    sizes = {BATCH_SIZE}
+    size = 1
+    while size < BATCH_SIZE:
+        sizes.add(size)
+        size *= 2
+    return sorted(sizes)
+
+
+def load_tflite_model():
+    """Load one quantized TFLite interpreter per batch size; returns {} if missing or unreadable"""
+    if not os.path.exists(TFLITE_MODEL_PATH):
+        return {}
+    try:
+        interpreters = {}
+        for size in tflite_batch_sizes():
+            interpreter = tf.lite.Interpreter(model_path=TFLITE_MODEL_PATH, num_threads=INFERENCE_THREADS)
+            input_index = interpreter.get_input_details()[0]['index']
+            interpreter.resize_tensor_input(input_index, [size, *MODEL_INPUT_SIZE, 3])
+            interpreter.allocate_tensors()
+            interpreters[size] = interpreter
+        print(f"✓ TFLite model loaded in process {os.getpid()} (batch sizes {sorted(interpreters)})")
+        return interpreters
+    except Exception as e:
+        print(f"✗ Error loading TFLite model: {e}")
+        return {}
+
+
+def load_tf_model():
+    """Load the SavedModel if converted, else the H5 model; returns None if neither loads"""
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(INFERENCE_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(INFERENCE_THREADS)
+    except RuntimeError as e:
+        # Raised if the TF runtime was already initialized in this process
+        print(f"✗ Could not set TF thread counts: {e}")
+
+    if os.path.isdir(SAVED_MODEL_PATH):
+        try:
+            model = tf.saved_model.load(SAVED_MODEL_PATH)
+            print(f"✓ SavedModel loaded in process {os.getpid()}")
+            return model
+        except Exception as e:
+            print(f"✗ Error loading SavedModel: {e}")
+
+    try:
+        model = load_model(MODEL_PATH)
+        print(f"✓ Model loaded in process {os.getpid()}")
+        return model
+    except Exception as e:
+        print(f"✗ Error loading model: {e}")
+        return None
+
+
+def build_infer_fn(model):
+    """Wrap a Keras model or SavedModel in a concrete inference function"""
+    if isinstance(model, tf.keras.Model):
+        # Concrete inference function, traced once so requests skip Keras predict() overhead
+        @tf.function(input_signature=[tf.TensorSpec([None, 256, 256, 3], tf.float32)])
+        def serve_disease_model(x):
+            return model(x, training=False)
+
+        return serve_disease_model.get_concrete_function()
+
+    # SavedModel exported by convert_model.py already carries a concrete signature
+    serving_fn = model.signatures['serving_default']
+    return lambda x: serving_fn(image=x)['predictions']
+
+
+def load_disease_model():
+    """Load this process's model once, preferring TFLite, then SavedModel, then H5"""
+    global tflite_interpreters, disease_model, INFER_FN, model_load_attempted
+    if model_load_attempted:
+        return
+
+    with model_load_lock:
+        if model_load_attempted:
+            return
+        try:
+            tflite_interpreters = load_tflite_model()
+            if not tflite_interpreters:
+                disease_model = load_tf_model()
+                if disease_model is not None:
+                    INFER_FN = build_infer_fn(disease_model)
+        except Exception as e:
+            print(f"✗ Error preparing model for inference: {e}")
+            tflite_interpreters = {}
+            disease_model = INFER_FN = None
+        finally:
+            # A failed load is not retried on every request; Gemini handles detection instead
+            model_load_attempted = True
+
+
+def model_available():
+    """Check whether a disease model could be loaded in this process"""
+    load_disease_model()
+    return bool(tflite_interpreters) or INFER_FN is not None
+
+
+def infer(batch):
+    """Run the disease model on a float32 image batch and return class probabilities"""
+    load_disease_model()
+    if not tflite_interpreters:
+        return INFER_FN(tf.constant(batch)).numpy()
+
+    # Pad up to the nearest preallocated size so the hot path never reallocates tensors
+    n = len(batch)
+    size = next(s for s in sorted(tflite_interpreters) if s >= n)
+    if size != n:
+        padding = np.zeros((size - n, *batch.shape[1:]), dtype=batch.dtype)
+        batch = np.concatenate([batch, padding])
+
+    interpreter = tflite_interpreters[size]
+    interpreter.set_tensor(interpreter.get_input_details()[0]['index'], batch)
+    interpreter.invoke()
+    return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])[:n]
+
+
+def run_batch_worker():
+    """Drain queued images into batches of up to BATCH_SIZE and run them together"""
+    while True:
+        items = [batch_queue.get()]
+        deadline = time.monotonic() + BATCH_TIMEOUT_MS / 1000
+        while len(items) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            batch = np.concatenate([img_array for img_array, _ in items])
+            predictions = infer(batch)
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            continue
+
+        for i, (_, future) in enumerate(items):
+            future.set_result(predictions[i:i + 1])
+
+
+def predict_disease(img_array):
+    """Queue a preprocessed image for batched inference and wait for its predictions"""
+    global batch_worker
+    if batch_worker is None:
+        with batch_worker_lock:
+            if batch_worker is None:
+                batch_worker = threading.Thread(target=run_batch_worker, daemon=True)
+                batch_worker.start()
+
+    future = Future()
+    batch_queue.put((img_array, future))
+    return future.result()
 
 
 def filter_classes_by_plant(plant_name):
     """Filter class names by selected plant"""
-    filtered_classes = []
-    for idx, class_name in enumerate(CLASS_NAMES):
-        class_plant = class_name.split('___')[0]
-        class_plant_clean = class_plant.replace('_', ' ').replace('(including sour)', '').replace(',', '').strip()
+    return PLANT_CLASSES.get(plant_name.lower(), [])
 
-        if class_plant_clean.lower() == plant_name.lower():
-            filtered_classes.append((idx, class_name))
 
-    return filtered_classes
+def classify_disease(img, plant_name):
+    """Predict the disease for the selected plant; returns (disease_name, confidence) or None"""
+    if not model_available():
+        return None
 
-
-def get_disease_info_gemini(disease_name, plant_name, language='English'):
-    """Get disease information, prevention, and remedies using Gemini API"""
     try:
-        prompt = f"""You are an agricultural expert. Provide detailed information about the {plant_name} plant disease: {disease_name}
+        img_array = preprocess_image(img)
+        predictions = predict_disease(img_array)
+
+        # Get top prediction for the selected plant only
+        idxs = PLANT_CLASS_INDICES[plant_name.lower()]
+        confs = predictions[0, idxs]
+        k = int(confs.argmax())
+        confidence = float(confs[k])
+        disease_class_name = CLASS_NAMES[idxs[k]]
+
+        if confidence <= 0.5:  # Threshold for plant-specific detection
+            return None
+
+        return disease_display_name(disease_class_name), confidence
+    except Exception as e:
+        print(f"Model prediction error: {e}")
+        return None
+
+
+# Static scaffolding of the disease-info prompt; only the three fields vary per call
+DISEASE_INFO_PROMPT = """You are an agricultural expert. Provide detailed information about the {plant_name} plant disease: {disease_name}
 
 Please provide the response in {language} language and include:
 
@@ -198,19 +501,42 @@ Please provide the response in {language} language and include:
 Format the response clearly with proper headings and bullet points.
 Use simple, farmer-friendly language that is easy to understand."""
 
-        model = genai.GenerativeModel('gemini-1.5-flash-exp-0827')  # Updated to a valid experimental model name
-        response = model.generate_content(prompt)
-        return response.text
+
+@ttl_cache(30 * 24 * 60 * 60, maxsize=1024)
+def fetch_disease_info(disease_name, plant_name, language):
+    """Query Gemini for disease information; only successful responses are cached"""
+    prompt = DISEASE_INFO_PROMPT.format(disease_name=disease_name, plant_name=plant_name, language=language)
+    response = GEMINI_MODEL.generate_content(prompt)
+    return response.text
+
+
+def stream_disease_info(disease_name, plant_name, language):
+    """Yield disease information as Gemini generates it, serving cached text in one piece"""
+    hit, cached = fetch_disease_info.cache_get(disease_name, plant_name, language)
+    if hit:
+        yield cached
+        return
+
+    prompt = DISEASE_INFO_PROMPT.format(disease_name=disease_name, plant_name=plant_name, language=language)
+    chunks = []
+    for chunk in GEMINI_MODEL.generate_content(prompt, stream=True):
+        chunks.append(chunk.text)
+        yield chunk.text
+    fetch_disease_info.cache_set((disease_name, plant_name, language), ''.join(chunks))
+
+
+def get_disease_info_gemini(disease_name, plant_name, language='English'):
+    """Get disease information, prevention, and remedies using Gemini API"""
+    try:
+        return fetch_disease_info(disease_name, plant_name, language)
     except Exception as e:
         print(f"Gemini API Error: {e}")
         return f"Error getting disease information: {str(e)}"
 
 
-def detect_with_gemini(image_data, plant_name, language='English'):
+def detect_with_gemini(image_part, plant_name, language='English'):
     """Fallback detection using Gemini API when model fails"""
     try:
-        img = Image.open(io.BytesIO(image_data))
-
         prompt = f"""You are an expert agricultural pathologist. Analyze this {plant_name} leaf image and provide:
 
 1. **Confirmation**: Is this a {plant_name} plant? (YES/NO)
@@ -227,18 +553,25 @@ Then provide detailed information in {language} language:
 
 Format the response clearly with proper headings and bullet points. Do not use markdown headers."""
 
-        model = genai.GenerativeModel('gemini-1.5-flash-exp-0827')  # Updated to a valid experimental model name
-        response = model.generate_content([prompt, img])
+        response = GEMINI_MODEL.generate_content([prompt, image_part])
         return response.text
     except Exception as e:
         print(f"Gemini detection error: {e}")
         return f"Error in Gemini detection: {str(e)}"
 
 
-def get_crop_recommendation(temperature, humidity, rainfall, soil_type):
-    """Get crop recommendation based on weather and soil"""
+def quantize(value, step):
+    """Round a numeric reading to the nearest step so similar conditions share a cache entry"""
     try:
-        prompt = f"""As an agricultural expert, recommend the top 5 most suitable crops for the following conditions:
+        return round(float(value) / step) * step
+    except (TypeError, ValueError):
+        return value
+
+
+@lru_cache(maxsize=1024)
+def fetch_crop_recommendation(temperature, humidity, rainfall, soil_type):
+    """Query Gemini for crop recommendations; only successful responses are cached"""
+    prompt = f"""As an agricultural expert, recommend the top 5 most suitable crops for the following conditions:
 
 - Temperature: {temperature}°C
 - Humidity: {humidity}%
@@ -253,14 +586,46 @@ Provide:
 
 Format as a clear, numbered list. Keep recommendations practical and region-appropriate for Indian agriculture."""
 
-        model = genai.GenerativeModel('gemini-1.5-flash-exp-0827')  # Updated to a valid experimental model name
-        response = model.generate_content(prompt)
-        return response.text
+    response = GEMINI_MODEL.generate_content(prompt)
+    return response.text
+
+
+def get_crop_recommendation(temperature, humidity, rainfall, soil_type):
+    """Get crop recommendation based on weather and soil"""
+    try:
+        return fetch_crop_recommendation(
+            quantize(temperature, 1),
+            quantize(humidity, 5),
+            quantize(rainfall, 0.5),
+            soil_type
+        )
     except Exception as e:
         print(f"Recommendation error: {e}")
         return f"Error getting recommendations: {str(e)}"
 
 
+@ttl_cache(24 * 60 * 60)
+def geocode_city(city):
+    """Look up (latitude, longitude) for a city via Open-Meteo; None if not found"""
+    geocode_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1&language=en&format=json"
+    geo_response = HTTP.get(geocode_url, timeout=5)
+    geo_response.raise_for_status()
+    geo_data = geo_response.json()
+
+    if 'results' not in geo_data:
+        return None
+    return geo_data['results'][0]['latitude'], geo_data['results'][0]['longitude']
+
+
+@ttl_cache(10 * 60)
+def fetch_weather(lat, lon):
+    """Fetch current weather and daily forecast from Open-Meteo"""
+    weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,precipitation,weather_code,wind_speed_10m&daily=temperature_2m_max,temperature_2m_min,precipitation_sum&timezone=auto"
+    weather_response = HTTP.get(weather_url, timeout=5)
+    weather_response.raise_for_status()
+    return weather_response.json()
+
+
 def query_gemini_weather(city):
     """Query Gemini for weather information"""
     try:
@@ -272,14 +637,108 @@ def query_gemini_weather(city):
 
         Format the response in a clear, structured way."""
 
-        model = genai.GenerativeModel('gemini-1.5-flash-exp-0827')  # Updated to a valid experimental model name
-        response = model.generate_content(prompt)
+        response = GEMINI_MODEL.generate_content(prompt)
         return response.text
     except Exception as e:
         print(f"Weather query error: {e}")
         return f"Error getting weather information: {str(e)}"
 
 
+def drain_prediction_log(wait=True):
+    """Collect up to PREDICTION_LOG_BATCH queued records, waiting up to PREDICTION_LOG_INTERVAL_MS for more"""
+    records = []
+    if wait:
+        records.append(prediction_log_queue.get())
+    deadline = time.monotonic() + PREDICTION_LOG_INTERVAL_MS / 1000
+    while len(records) < PREDICTION_LOG_BATCH:
+        remaining = deadline - time.monotonic()
+        try:
+            if wait and remaining > 0:
+                records.append(prediction_log_queue.get(timeout=remaining))
+            else:
+                records.append(prediction_log_queue.get_nowait())
+        except queue.Empty:
+            break
+    return records
+
+
+def write_prediction_log(records):
+    """Bulk-insert prediction records, logging (not raising) on failure"""
+    try:
+        predictions_collection.insert_many(records, ordered=False)
+    except Exception as e:
+        print(f"✗ Error saving {len(records)} prediction records: {e}")
+
+
+def run_prediction_log_worker():
+    """Coalesce queued prediction records into insert_many batches"""
+    while True:
+        write_prediction_log(drain_prediction_log())
+
+
+def flush_prediction_log():
+    """Write any records still queued when the process exits"""
+    records = drain_prediction_log(wait=False)
+    while records:
+        write_prediction_log(records)
+        records = drain_prediction_log(wait=False)
+
+
+def log_prediction(record):
+    """Queue a prediction record for the background writer; drops it if the queue is full"""
+    global prediction_log_worker
+    if prediction_log_worker is None:
+        with prediction_log_lock:
+            if prediction_log_worker is None:
+                prediction_log_worker = threading.Thread(target=run_prediction_log_worker, daemon=True)
+                prediction_log_worker.start()
+                atexit.register(flush_prediction_log)
+
+    try:
+        prediction_log_queue.put_nowait(record)
+    except queue.Full:
+        print("✗ Prediction log queue full, dropping record")
+
+
+def ensure_indexes():
+    """Create the indexes used by login lookups and per-user record queries"""
+    user_timeline = [('user_id', ASCENDING), ('timestamp', DESCENDING)]
+    predictions_collection.create_index(user_timeline)
+    db['saved_reports'].create_index(user_timeline)
+    db['diagnosis_records'].create_index(user_timeline)
+    users_collection.create_index('email', unique=True)
+
+
+def warm_up_model():
+    """Run one dummy inference so graph construction and kernel setup happen before the first request"""
+    if not model_available():
+        return
+    try:
+        start = time.monotonic()
+        predict_disease(np.zeros((1, *MODEL_INPUT_SIZE, 3), dtype=np.float32))
+        print(f"✓ Model warmed up in {time.monotonic() - start:.2f}s")
+    except Exception as e:
+        print(f"✗ Error warming up model: {e}")
+
+
+def create_indexes_in_background():
+    """Create MongoDB indexes without letting an unreachable server delay worker startup"""
+    def run():
+        try:
+            ensure_indexes()
+            print("✓ MongoDB indexes ready")
+        except Exception as e:
+            print(f"✗ Error creating MongoDB indexes: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def init_worker():
+    """Per-process startup work; run by gunicorn's post_worker_init hook or before app.run"""
+    create_indexes_in_background()
+    warm_up_model()
+
+
 def test_gemini_connection():
     """Test Gemini API connection"""
     try:
@@ -287,8 +746,7 @@ def test_gemini_connection():
         print("Testing Gemini API Connection...")
         print("=" * 60)
 
-        model = genai.GenerativeModel('gemini-1.5-flash-exp-0827')  # Updated to a valid experimental model name
-        response = model.generate_content("Say 'Hello, PlantCare AI is ready!'")
+        response = GEMINI_MODEL.generate_content("Say 'Hello, PlantCare AI is ready!'")
         print(f"✓ Gemini API is working!")
         print(f"✓ Response: {response.text}")
         print(f"✓ Available plants: {len(PLANT_LIST)} types")
@@ -297,6 +755,17 @@ def test_gemini_connection():
         print(f"✗ Error testing Gemini API: {e}\n")
 
 
+# ============== ERROR HANDLERS ==============
+
+@app.errorhandler(Exception)
+def handle_unexpected_error(e):
+    """Return JSON for uncaught errors instead of an empty 500"""
+    if isinstance(e, HTTPException):
+        return e
+    app.logger.exception("Unhandled error on %s", request.path)
+    return jsonify({'success': False, 'message': 'Internal server error'}), 500
+
+
 # ============== AUTHENTICATION ROUTES ==============
 
 @app.route('/')
@@ -350,10 +819,10 @@ def api_signup():
         email = data.get('email')
         password = data.get('password')
 
-        if users_collection.find_one({'email': email}):
+        if users_collection.find_one({'email': email}, {'_id': 1}):
             return jsonify({'success': False, 'message': 'Email already exists'}), 400
 
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
 
         user = {
             'name': name,
@@ -365,6 +834,9 @@ def api_signup():
         result = users_collection.insert_one(user)
 
         return jsonify({'success': True, 'message': 'Signup successful'})
+    except DuplicateKeyError:
+        # A concurrent signup with the same email won the race on the unique index
+        return jsonify({'success': False, 'message': 'Email already exists'}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -376,7 +848,7 @@ def api_login():
         email = data.get('email')
         password = data.get('password')
 
-        user = users_collection.find_one({'email': email})
+        user = users_collection.find_one({'email': email}, {'name': 1, 'password': 1})
 
         if not user:
             return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
@@ -405,6 +877,12 @@ def get_plants():
 
 # ============== DISEASE DETECTION ROUTES ==============
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    max_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'success': False, 'message': f'Image is too large. Please upload an image under {max_mb} MB.'}), 413
+
+
 @app.route('/api/detect-disease', methods=['POST'])
 def detect_disease():
     try:
@@ -414,14 +892,42 @@ def detect_disease():
         image_file = request.files['image']
         language = request.form.get('language', 'English')
         plant_name = request.form.get('plant_name', '')
+        # Clients that opt in fetch disease info separately from the SSE endpoint
+        stream_info = request.form.get('stream_info') == '1'
 
         if not plant_name:
             return jsonify({'success': False, 'message': 'Please select a plant type first'}), 400
 
+        # Read the upload once: Gemini needs the raw bytes and PIL decodes from a zero-copy view of them
         image_data = image_file.read()
 
-        # Validate if image is a plant and matches selected plant
-        is_plant, is_correct_plant = validate_plant_image(image_data, plant_name)
+        # Decode once and share the image between validation, prediction and fallback
+        try:
+            img, mime_type = decode_once(image_data)
+        except Exception as e:
+            print(f"Image decode error: {e}")
+            return jsonify({'success': False, 'message': 'Could not read the uploaded image. Please upload a valid image file.'}), 400
+
+        image_part = gemini_image_part(image_data, img, mime_type)
+
+        # Validate if image is a plant and matches selected plant (in flight while the model runs)
+        validate_future = gemini_executor.submit(validate_plant_image, image_part, plant_name)
+
+        # Filter classes for selected plant
+        plant_classes = filter_classes_by_plant(plant_name)
+
+        # Try model prediction first, fetching disease info before validation completes
+        prediction = classify_disease(img, plant_name) if plant_classes else None
+        info_future = None
+        if prediction:
+            disease_name, confidence = prediction
+            if not stream_info:
+                info_future = gemini_executor.submit(get_disease_info_gemini, disease_name, plant_name, language)
+
+        is_plant, is_correct_plant = validate_future.result()
+
+        if not (is_plant and is_correct_plant) and info_future:
+            info_future.cancel()
 
         if not is_plant:
             return jsonify({
@@ -435,94 +941,102 @@ def detect_disease():
                 'message': f'The uploaded image does not appear to be a {plant_name} plant. Please upload a {plant_name} leaf image or select the correct plant type.'
             }), 400
 
-        # Filter classes for selected plant
-        plant_classes = filter_classes_by_plant(plant_name)
-
         if not plant_classes:
             return jsonify({
                 'success': False,
                 'message': f'No disease data available for {plant_name}. Using AI analysis instead.'
             }), 400
 
-        # Try model prediction first
-        model_success = False
-        if disease_model:
-            try:
-                img_array = preprocess_image(image_data)
-                predictions = disease_model.predict(img_array)
-
-                # Get predictions for the selected plant only
-                plant_predictions = []
-                for idx, class_name in plant_classes:
-                    conf = float(predictions[0][idx])
-                    plant_predictions.append((idx, class_name, conf))
-
-                # Sort by confidence
-                plant_predictions.sort(key=lambda x: x[2], reverse=True)
-
-                # Get top prediction for this plant
-                if plant_predictions:
-                    predicted_class_idx, disease_class_name, confidence = plant_predictions[0]
-
-                    if confidence > 0.5:  # Threshold for plant-specific detection
-                        model_success = True
-
-                        # Extract disease name
-                        disease_name = disease_class_name.split('___')[
-                            1] if '___' in disease_class_name else disease_class_name
-                        disease_name = disease_name.replace('_', ' ')
-
-                        # Get detailed info from Gemini
-                        disease_info = get_disease_info_gemini(disease_name, plant_name, language)
-
-                        # Save prediction
-                        prediction_record = {
-                            'user_id': session.get('user_id'),
-                            'plant_name': plant_name,
-                            'disease_name': disease_name,
-                            'confidence': confidence,
-                            'language': language,
-                            'timestamp': datetime.now(),
-                            'method': 'model'
-                        }
-                        predictions_collection.insert_one(prediction_record)
-
-                        return jsonify({
-                            'success': True,
-                            'method': 'model',
-                            'plant_name': plant_name,
-                            'disease_name': disease_name,
-                            'confidence': confidence,
-                            'disease_info': disease_info
-                        })
-            except Exception as e:
-                print(f"Model prediction error: {e}")
-
-        # Fallback to Gemini if model fails or low confidence
-        if not model_success:
-            gemini_result = detect_with_gemini(image_data, plant_name, language)
-
+        if prediction:
+            # Save prediction
             prediction_record = {
                 'user_id': session.get('user_id'),
                 'plant_name': plant_name,
+                'disease_name': disease_name,
+                'confidence': confidence,
                 'language': language,
                 'timestamp': datetime.now(),
-                'method': 'gemini',
-                'result': gemini_result
+                'method': 'model'
             }
-            predictions_collection.insert_one(prediction_record)
+            log_prediction(prediction_record)
 
-            return jsonify({
+            result = {
                 'success': True,
-                'method': 'gemini',
+                'method': 'model',
                 'plant_name': plant_name,
-                'disease_info': gemini_result
-            })
+                'disease_name': disease_name,
+                'confidence': confidence
+            }
+
+            if stream_info:
+                result['disease_info_stream'] = url_for(
+                    'disease_info_stream',
+                    disease_name=disease_name,
+                    plant_name=plant_name,
+                    language=language
+                )
+            else:
+                # Get detailed info from Gemini
+                result['disease_info'] = info_future.result()
 
+            return jsonify(result)
+
+        # Fallback to Gemini if model fails or low confidence
+        gemini_result = detect_with_gemini(image_part, plant_name, language)
+
+        prediction_record = {
+            'user_id': session.get('user_id'),
+            'plant_name': plant_name,
+            'language': language,
+            'timestamp': datetime.now(),
+            'method': 'gemini',
+            'result': gemini_result
+        }
+        log_prediction(prediction_record)
+
+        return jsonify({
+            'success': True,
+            'method': 'gemini',
+            'plant_name': plant_name,
+            'disease_info': gemini_result
+        })
+
+    except HTTPException:
+        # Let Flask's error handlers respond (e.g. the JSON 413 for oversized uploads)
+        raise
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/disease-info/stream', methods=['GET'])
+def disease_info_stream():
+    """Stream disease information to the browser as Server-Sent Events"""
+    disease_name = request.args.get('disease_name', '').strip()
+    plant_name = request.args.get('plant_name', '').strip()
+    language = request.args.get('language', 'English')
+
+    # Only known (plant, disease, language) combinations reach Gemini and the shared cache
+    if (disease_name not in PLANT_DISEASES.get(plant_name.lower(), ())
+            or language not in LANGUAGE_CODES):
+        return jsonify({'success': False, 'message': 'Unknown plant, disease or language'}), 400
+
+    def generate():
+        try:
+            for text in stream_disease_info(disease_name, plant_name, language):
+                yield f"data: {json.dumps({'text': text})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"Gemini streaming error: {e}")
+            message = f"Error getting disease information: {str(e)}"
+            yield f"event: error\ndata: {json.dumps({'message': message})}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 # ============== WEATHER ROUTES ==============
 
 @app.route('/api/weather', methods=['GET'])
@@ -531,20 +1045,15 @@ def get_weather():
         city = request.args.get('city', 'Bangalore')
 
         # Using Open-Meteo API (free, no API key needed)
-        geocode_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city}&count=1&language=en&format=json"
-        geo_response = requests.get(geocode_url)
-        geo_data = geo_response.json()
+        location = geocode_city(city.strip().lower())
 
-        if 'results' not in geo_data:
+        if location is None:
             return jsonify({'success': False, 'message': 'City not found'}), 404
 
-        lat = geo_data['results'][0]['latitude']
-        lon = geo_data['results'][0]['longitude']
+        lat, lon = location
 
         # Get weather data
-        weather_url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current=temperature_2m,relative_humidity_2m,precipitation,weather_code,wind_speed_10m&daily=temperature_2m_max,temperature_2m_min,precipitation_sum&timezone=auto"
-        weather_response = requests.get(weather_url)
-        weather_data = weather_response.json()
+        weather_data = fetch_weather(lat, lon)
 
         return jsonify({
             'success': True,
@@ -624,7 +1133,7 @@ def save_diagnosis():
 
         return jsonify({'success': True, 'id': str(result.inserted_id)})
     except Exception as e:
-        return jupytext({'success': False, 'message': str(e)}), 500
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 
 @app.route('/api/get-saved-records', methods=['GET'])
@@ -657,5 +1166,6 @@ def get_saved_records():
 # ============== MAIN ==============
 
 if __name__ == '__main__':
+    init_worker()
     test_gemini_connection()
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
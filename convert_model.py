@@ -0,0 +1,97 @@
+"""
+One-off conversions of the Keras disease model for faster serving.
+
+Usage:
+    python convert_model.py tflite path/to/sample_leaf_images
+    python convert_model.py savedmodel
+
+tflite: INT8-quantized TFLite model. The sample images are used as the
+representative dataset for post-training quantization; a few hundred leaves
+covering all plants is plenty. Written to models/plant_disease_model.tflite.
+
+savedmodel: TensorFlow SavedModel with a single 'serving_default' signature,
+loaded without rebuilding Keras layer objects. Written to
+models/plant_disease_model_savedmodel.
+
+app.py picks up the converted model in place of the H5 on its next start,
+preferring TFLite over SavedModel.
+"""
+import glob
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+MODEL_PATH = 'models/plant_disease_model.h5'
+TFLITE_MODEL_PATH = 'models/plant_disease_model.tflite'
+SAVED_MODEL_PATH = 'models/plant_disease_model_savedmodel'
+MODEL_INPUT_SIZE = (256, 256)
+IMAGE_EXTENSIONS = ('*.jpg', '*.jpeg', '*.png')
+MAX_SAMPLES = 300
+
+
+def load_sample_images(image_dir):
+    """Collect sample image paths recursively from a directory"""
+    paths = []
+    for ext in IMAGE_EXTENSIONS:
+        paths.extend(glob.glob(os.path.join(image_dir, '**', ext), recursive=True))
+    return sorted(paths)[:MAX_SAMPLES]
+
+
+def load_model_input(path):
+    """Mirror app.decode_once + app.preprocess_image so calibration sees the served inputs"""
+    img = Image.open(path)
+    img.draft('RGB', MODEL_INPUT_SIZE)
+    img = img.convert('RGB').resize(MODEL_INPUT_SIZE, reducing_gap=3.0)
+    img_array = np.asarray(img, dtype=np.float32) / np.float32(255.0)
+    return img_array[None, ...]
+
+
+def representative_dataset(paths):
+    """Yield calibration images preprocessed exactly as at serving time"""
+    def generator():
+        for path in paths:
+            yield [load_model_input(path)]
+    return generator
+
+
+def convert_to_tflite(image_dir):
+    """Convert the H5 model to TFLite with full-integer post-training quantization"""
+    paths = load_sample_images(image_dir)
+    if not paths:
+        raise SystemExit(f"No sample images found in {image_dir}")
+
+    disease_model = tf.keras.models.load_model(MODEL_PATH)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(disease_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset(paths)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    tflite_model = converter.convert()
+
+    with open(TFLITE_MODEL_PATH, 'wb') as f:
+        f.write(tflite_model)
+    print(f"✓ Saved {TFLITE_MODEL_PATH} ({len(tflite_model) / 1e6:.1f} MB, {len(paths)} calibration images)")
+
+
+def convert_to_savedmodel():
+    """Export the H5 model as a SavedModel with an 'image' -> 'predictions' signature"""
+    disease_model = tf.keras.models.load_model(MODEL_PATH)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, 256, 256, 3], tf.float32, name='image')])
+    def serve(image):
+        return {'predictions': disease_model(image, training=False)}
+
+    tf.saved_model.save(disease_model, SAVED_MODEL_PATH, signatures={'serving_default': serve})
+    print(f"✓ Saved {SAVED_MODEL_PATH}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'tflite':
+        convert_to_tflite(sys.argv[2])
+    elif len(sys.argv) == 2 and sys.argv[1] == 'savedmodel':
+        convert_to_savedmodel()
+    else:
+        raise SystemExit(__doc__)
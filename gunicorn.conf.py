@@ -0,0 +1,38 @@
+"""
+Gunicorn configuration for production serving.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+
+preload_app imports app.py once in the master process, so every worker shares
+the same Flask secret key and sessions stay valid whichever worker handles a
+request. The disease model itself is loaded in post_worker_init, after fork:
+TensorFlow's runtime thread pools do not survive fork, so the master never
+touches TF. Threaded workers let each process overlap many slow
+Gemini/Open-Meteo calls.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# Handlers spend nearly all their time blocked on Gemini/Open-Meteo with the GIL
+# released, so threads are sized for in-flight I/O rather than for CPU cores
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+worker_class = 'gthread'
+
+# Each detect request can hold two Gemini executor slots, so keep the pool ahead of the threads
+os.environ.setdefault('GEMINI_WORKERS', str(2 * threads))
+
+# Split the cores between workers instead of giving every worker's TF/TFLite runtime all of them
+os.environ.setdefault('INFERENCE_THREADS', str(max(1, multiprocessing.cpu_count() // workers)))
+preload_app = True
+
+# Gemini calls can take several seconds each
+timeout = 120
+
+
+def post_worker_init(worker):
+    """Run per-process setup after fork (DB indexes, model loading and warm-up)"""
+    import app
+    app.init_worker()